@@ -1,12 +1,14 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from pathlib import Path
 
-CSV_PATH = "results.csv"          # run from repo root
+CSV_PATH = Path("results.csv")    # run from repo root
 OUT_DIR = Path("python/plots")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
-
-df = pd.read_csv(CSV_PATH)
 
 # Candidate sweep axes in priority order
 CANDIDATE_X = [
@@ -22,18 +24,97 @@ CANDIDATE_X = [
 
 METRICS = ["miss_rate", "amat"]
 
-def pick_x_column(d: pd.DataFrame) -> str | None:
+# Non-varying params shown in plot titles for context
+CONTEXT_COLS = ["cache_kb", "line_size", "assoc", "hit_latency", "miss_penalty", "policy", "trace"]
+
+# Explicit dtypes for the columns we read; categoricals compare by integer code.
+# Integer columns use the nullable types so a blank cell reads as <NA>.
+CSV_DTYPES = {
+    "experiment": "category",
+    "cache_kb": "Int32",
+    "line_size": "Int32",
+    "assoc": "Int16",
+    "hit_latency": "Int32",
+    "miss_penalty": "Int32",
+    "policy": "category",
+    "working_set_kb": "Int32",
+    "stride_bytes": "Int32",
+    "miss_rate": "float32",
+    "amat": "float32",
+    "hits": "Int64",
+    "misses": "Int64",
+}
+
+# Not plotted, but shown in the baseline-row printout
+REPORT_COLS = ["hits", "misses"]
+
+# Columns the script actually uses
+NEEDED_COLS = (
+    {"experiment"} | set(CANDIDATE_X) | set(METRICS) | set(CONTEXT_COLS) | set(REPORT_COLS)
+)
+
+# Identifies the projection/dtypes a Parquet cache was built with, so a cache
+# written under different settings is not reused
+CACHE_SCHEMA_KEY = hashlib.sha1(
+    repr((sorted(NEEDED_COLS), sorted(CSV_DTYPES.items()))).encode()
+).hexdigest()
+
+def read_results_csv(path: Path) -> pd.DataFrame:
+    # Only parse the columns the script actually uses
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in NEEDED_COLS]
+    dtypes = {c: t for c, t in CSV_DTYPES.items() if c in usecols}
+    try:
+        # Multithreaded parser; needs pyarrow installed
+        return pd.read_csv(path, usecols=usecols, dtype=dtypes, engine="pyarrow")
+    except ImportError:
+        return pd.read_csv(path, usecols=usecols, dtype=dtypes, engine="c")
+
+def load_results(csv_path: Path, use_cache: bool) -> pd.DataFrame:
+    # Parsed-CSV cache sits next to the CSV and is refreshed when the CSV changes
+    parquet_path = csv_path.with_suffix(".parquet")
+    cache_fresh = (
+        use_cache
+        and parquet_path.exists()
+        and parquet_path.stat().st_mtime >= csv_path.stat().st_mtime
+    )
+    if cache_fresh:
+        try:
+            cached = pd.read_parquet(parquet_path)
+            if cached.attrs.get("plotter_schema") == CACHE_SCHEMA_KEY:
+                return cached
+        except Exception:
+            pass  # missing engine, truncated or corrupt file: treat as a cache miss
+
+    df = read_results_csv(csv_path)
+    if df.empty:
+        return df  # nothing worth caching; main() exits without plotting
+    df.attrs["plotter_schema"] = CACHE_SCHEMA_KEY  # stored in the parquet metadata
+    # Caching is best-effort. Write to a temp file and rename it into place so
+    # an interrupted write never leaves a half-written cache that looks fresh.
+    # Arrow errors derive from OSError/ValueError/TypeError/NotImplementedError.
+    tmp_path = parquet_path.with_name(f".{parquet_path.name}.{os.getpid()}.tmp")
+    try:
+        df.to_parquet(tmp_path, compression="zstd", index=False)
+        os.replace(tmp_path, parquet_path)
+    except (ImportError, OSError, ValueError, TypeError, NotImplementedError):
+        try:
+            tmp_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+    return df
+
+def pick_x_column(nunique: pd.Series) -> str | None:
     """
-    Pick an x-axis column automatically:
+    Pick an x-axis column automatically from one experiment's per-column
+    distinct-value counts:
     - Prefer numeric columns that vary (nunique > 1)
     - If only 'policy' varies, use policy
     - If multiple vary, pick the first by priority in CANDIDATE_X
     """
-    nunique = {c: d[c].nunique(dropna=False) for c in CANDIDATE_X if c in d.columns}
-
     # Pick first varying column by priority
     for c in CANDIDATE_X:
-        if c in nunique and nunique[c] > 1:
+        if c in nunique.index and nunique[c] > 1:
             return c
     return None
 
@@ -41,103 +122,302 @@ def is_categorical_x(xcol: str) -> bool:
     return xcol == "policy"
 
 def stable_sort(d: pd.DataFrame, xcol: str) -> pd.DataFrame:
-    d = d.copy()
     if xcol == "policy":
         order = ["LRU", "FIFO", "RANDOM"]
         if "policy" in d.columns:
-            d.loc[:, "policy"] = pd.Categorical(d["policy"], categories=order, ordered=True)
+            # policy is loaded as a categorical, so just reorder its categories
+            d = d.assign(policy=d["policy"].cat.set_categories(order, ordered=True))
         return d.sort_values("policy")
     else:
         return d.sort_values(xcol)
 
+# One Figure/Axes reused for every plot; cleared between plots instead of
+# paying figure/canvas setup each time. matplotlib is imported on first use
+# so runs with nothing to plot never pay for it.
+_PLT = None
+_FIG = None
+_AX = None
+
+def get_axes():
+    global _PLT, _FIG, _AX
+    if _AX is None:
+        import matplotlib
+        matplotlib.use("Agg")  # file output only; skip GUI backend probing
+        import matplotlib.pyplot as plt
+        _PLT = plt
+        _FIG, _AX = plt.subplots()
+    return _FIG, _AX
+
+def save_figure(fig, outpath: Path):
+    # tight_layout is a single layout pass, unlike bbox_inches="tight" which
+    # renders the figure twice; low zlib effort keeps PNG encoding cheap
+    # Start from the default subplot params so the layout does not depend on
+    # the plot this reused figure drew before
+    fig.subplots_adjust(**{k: _PLT.rcParams[f"figure.subplot.{k}"]
+                           for k in ("left", "right", "bottom", "top")})
+    fig.tight_layout()
+    if outpath.suffix == ".png":
+        fig.savefig(outpath, dpi=110, pil_kwargs={"compress_level": 1, "optimize": False})
+    else:
+        fig.savefig(outpath)
+
 def plot_line(d: pd.DataFrame, xcol: str, ycol: str, title: str, xlabel: str, outpath: Path):
-    d = stable_sort(d, xcol)
-    plt.figure()
-    plt.plot(d[xcol], d[ycol], marker="o")
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ycol)
-    plt.grid(True)
-    plt.savefig(outpath, dpi=200, bbox_inches="tight")
-    plt.close()
-    print(f"Wrote {outpath}")
+    # Nullable integer columns would come back as object arrays; make blanks NaN
+    xv = d[xcol].to_numpy(dtype=float, na_value=np.nan)
+    yv = d[ycol].to_numpy(dtype=float, na_value=np.nan)
+    fig, ax = get_axes()
+    ax.clear()
+    ax.plot(xv, yv, marker="o")
+    ax.set_title(title, wrap=True)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ycol)
+    ax.grid(True)
+    save_figure(fig, outpath)
 
 def plot_bar(d: pd.DataFrame, xcol: str, ycol: str, title: str, xlabel: str, outpath: Path):
-    d = stable_sort(d, xcol)
-    plt.figure()
-    plt.bar(d[xcol].astype(str), d[ycol])
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ycol)
-    plt.grid(True, axis="y")
-    plt.savefig(outpath, dpi=200, bbox_inches="tight")
-    plt.close()
-    print(f"Wrote {outpath}")
+    # Plain list of per-row labels; avoids building an object-dtype Series
+    labels = [str(v) for v in d[xcol].to_numpy()]
+    yv = d[ycol].to_numpy(dtype=float, na_value=np.nan)
+    fig, ax = get_axes()
+    ax.clear()
+    ax.bar(labels, yv)
+    ax.set_title(title, wrap=True)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ycol)
+    ax.grid(True, axis="y")
+    save_figure(fig, outpath)
+
+def plot_overlay(curves: list, xcol: str, ycol: str, title: str, xlabel: str, outpath: Path):
+    """
+    Overlay several sweeps that share an x column. The curves are joined
+    with NaN breaks and drawn as one LineCollection plus one scatter, with a
+    colour per curve, so the artist count does not grow with the sweep count.
+    """
+    arrays = [(name, c[xcol].to_numpy(dtype=float, na_value=np.nan),
+               c[ycol].to_numpy(dtype=float, na_value=np.nan))
+              for name, c in curves]
+    xs = np.concatenate([np.append(xv, np.nan) for _, xv, _ in arrays])
+    ys = np.concatenate([np.append(yv, np.nan) for _, _, yv in arrays])
+    fig, ax = get_axes()
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import to_rgba_array
+    from matplotlib.font_manager import FontProperties
+
+    colors = to_rgba_array([f"C{i % 10}" for i in range(len(arrays))])
+    # Curve index of every point in xs/ys, NaN separators included
+    curve_of = np.repeat(np.arange(len(arrays)), [len(xv) + 1 for _, xv, _ in arrays])
+    points = np.column_stack([xs, ys])
+    # One segment per curve; NaN breaks inside a curve also break its line
+    bounds = np.cumsum([0] + [len(xv) + 1 for _, xv, _ in arrays])
+    segments = [points[a:b - 1] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    ax.clear()
+    ax.add_collection(LineCollection(segments, colors=colors))
+    ax.scatter(xs, ys, c=colors[curve_of], zorder=2)
+    ax.autoscale_view()
+
+    # Name each curve at its last point, in its colour, since these artists
+    # carry no legend entries. Labels are stacked so ends that are close in y
+    # do not overlap, and the x range is widened on the right so they fit
+    # inside the axes instead of letting tight_layout squeeze the plot.
+    label_size = FontProperties(size="small").get_size_in_points()
+    px_to_pt = 72 / fig.dpi
+    ends = []
+    for k, (name, xv, yv) in enumerate(arrays):
+        finite = np.isfinite(xv) & np.isfinite(yv)  # blanks sort last; label the last real point
+        if finite.any():
+            x_end, y_end = xv[finite][-1], yv[finite][-1]
+            y_pt = ax.transData.transform((x_end, y_end))[1] * px_to_pt
+            ends.append((y_pt, name, x_end, y_end, colors[k]))
+    ends.sort(key=lambda e: e[0])
+    anns = []
+    prev = -np.inf
+    for y_pt, name, x_end, y_end, color in ends:
+        placed = max(y_pt, prev + 1.2 * label_size)
+        prev = placed
+        ann = ax.annotate(name, (x_end, y_end), textcoords="offset points",
+                          xytext=(4, placed - y_pt), va="center", color=color,
+                          fontsize="small", annotation_clip=False)
+        ann.set_in_layout(False)
+        anns.append(ann)
+    if anns:
+        renderer = fig.canvas.get_renderer()
+        label_px = max(t.get_window_extent(renderer).x1 - ax.transData.transform((t.xy[0], 0))[0]
+                       for t in anns)
+        label_frac = min(label_px / ax.get_window_extent(renderer).width, 0.6)
+        x0, _ = ax.get_xlim()
+        x_last = max(t.xy[0] for t in anns)
+        ax.set_xlim(x0, x0 + (x_last - x0) / (1 - label_frac))
+    ax.set_title(title, wrap=True)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ycol)
+    ax.grid(True)
+    save_figure(fig, outpath)
+
+def usable_cpus() -> int:
+    # CPUs this process may run on; cpu_count() ignores affinity/cgroup pinning
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+def render_one(job: tuple) -> Path:
+    """
+    Render a single plot. May run in a worker process, so it only receives
+    the columns it draws.
+    """
+    plot_fn, d, xcol, ycol, title, xlabel, outpath = job
+    plot_fn(d, xcol, ycol, title, xlabel, outpath)
+    return outpath
+
+class _SafeNameTable(dict):
+    """
+    str.translate table mapping every char that is not alphanumeric, '-' or
+    '_' to '_'. Entries are filled in on first lookup, so any code point works.
+    """
+    def __missing__(self, i: int):
+        ch = chr(i)
+        value = i if ch.isalnum() or ch in "-_" else "_"
+        self[i] = value
+        return value
+
+_SAFE_NAME_TABLE = _SafeNameTable()
 
 def safe_name(s: str) -> str:
-    return "".join(ch if ch.isalnum() or ch in ("-", "_") else "_" for ch in s)
-
-# Optional: show baseline rows in terminal if present
-if "experiment" in df.columns:
-    base = df[df["experiment"].str.contains("baseline", na=False)]
-    if not base.empty:
-        print("Baseline rows:")
-        print(base.to_string(index=False))
-        print()
-
-# Generate plots per experiment
-experiments = sorted(df["experiment"].unique())
-
-for exp in experiments:
-    d = df[df["experiment"] == exp].copy()
-    if d.empty:
-        continue
-
-    xcol = pick_x_column(d)
-    if xcol is None:
-        print(f"[SKIP] {exp}: No varying parameter found (all candidate x columns constant).")
-        continue
-
-    # Create a short description string for titles
-    # We'll show non-varying key params to give context in the title.
-    context_cols = ["cache_kb", "line_size", "assoc", "hit_latency", "miss_penalty", "policy", "trace"]
-    context_parts = []
-    for c in context_cols:
-        if c in d.columns and d[c].nunique(dropna=False) == 1 and c != xcol:
-            context_parts.append(f"{c}={d[c].iloc[0]}")
-    context = ", ".join(context_parts[:4])  # keep title short
-
-    xlabel = xcol
-    if xcol == "cache_kb":
-        xlabel = "Cache size (KB)"
-    elif xcol == "working_set_kb":
-        xlabel = "Working set (KB)"
-    elif xcol == "assoc":
-        xlabel = "Associativity (ways)"
-    elif xcol == "line_size":
-        xlabel = "Line size (bytes)"
-    elif xcol == "stride_bytes":
-        xlabel = "Stride (bytes)"
-    elif xcol == "miss_penalty":
-        xlabel = "Miss penalty (cycles)"
-    elif xcol == "hit_latency":
-        xlabel = "Hit latency (cycles)"
-    elif xcol == "policy":
-        xlabel = "Replacement policy"
-
-    for metric in METRICS:
-        if metric not in d.columns:
+    return s.translate(_SAFE_NAME_TABLE)
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot cache sweep results from results.csv")
+    parser.add_argument("--csv", type=Path, default=CSV_PATH,
+                        help=f"results file to plot (default: {CSV_PATH})")
+    parser.add_argument("--out-dir", type=Path, default=OUT_DIR,
+                        help=f"directory the plots are written to (default: {OUT_DIR})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="re-parse the CSV even if its .parquet cache is up to date")
+    parser.add_argument("--jobs", type=int, default=usable_cpus(),
+                        help="number of worker processes used to render plots (default: usable CPUs)")
+    parser.add_argument("--svg", action="store_true",
+                        help="write vector SVG plots instead of PNG")
+    args = parser.parse_args()
+
+    out_dir = args.out_dir
+    df = load_results(args.csv, use_cache=not args.no_cache)
+    if df.empty:
+        print(f"No rows in {args.csv}; nothing to plot.")
+        return
+
+    # Split once by experiment; each subframe is materialized a single time
+    by_exp = df.groupby("experiment", sort=False, observed=True)
+    groups = {name: g for name, g in by_exp}
+
+    # Distinct-value counts for every x/context column, all experiments in one pass
+    count_cols = [c for c in dict.fromkeys(CANDIDATE_X + CONTEXT_COLS) if c in df.columns]
+    nunique_by_exp = by_exp[count_cols].nunique(dropna=False)
+
+    # Optional: show baseline rows in terminal if present
+    if "experiment" in df.columns:
+        base = df[df["experiment"].str.contains("baseline", na=False)]
+        if not base.empty:
+            print("Baseline rows:")
+            print(base.to_string(index=False))
+            print()
+
+    # Generate plots per experiment
+    experiments = list(groups)
+    jobs = []
+    suffix = ".svg" if args.svg else ".png"
+    line_sweeps = {}  # xcol -> (xlabel, [(exp, sorted slice), ...])
+
+    for exp in experiments:
+        d = groups[exp]
+        if d.empty:
+            continue
+
+        nunique = nunique_by_exp.loc[exp]
+        xcol = pick_x_column(nunique)
+        if xcol is None:
+            print(f"[SKIP] {exp}: No varying parameter found (all candidate x columns constant).")
+            continue
+
+        # Sort once; every metric plot for this experiment shares the ordering
+        d = stable_sort(d, xcol)
+
+        # Create a short description string for titles
+        # We'll show non-varying key params to give context in the title.
+        context_parts = []
+        for c in CONTEXT_COLS:
+            if c in nunique.index and nunique[c] == 1 and c != xcol:
+                context_parts.append(f"{c}={d[c].iloc[0]}")
+        context = ", ".join(context_parts[:4])  # keep title short
+
+        xlabel = xcol
+        if xcol == "cache_kb":
+            xlabel = "Cache size (KB)"
+        elif xcol == "working_set_kb":
+            xlabel = "Working set (KB)"
+        elif xcol == "assoc":
+            xlabel = "Associativity (ways)"
+        elif xcol == "line_size":
+            xlabel = "Line size (bytes)"
+        elif xcol == "stride_bytes":
+            xlabel = "Stride (bytes)"
+        elif xcol == "miss_penalty":
+            xlabel = "Miss penalty (cycles)"
+        elif xcol == "hit_latency":
+            xlabel = "Hit latency (cycles)"
+        elif xcol == "policy":
+            xlabel = "Replacement policy"
+
+        for metric in METRICS:
+            if metric not in d.columns:
+                continue
+
+            title = f"{exp}: {metric} vs {xcol}"
+            if context:
+                title += f" ({context})"
+
+            outpath = out_dir / f"{safe_name(exp)}_{metric}{suffix}"
+
+            plot_fn = plot_bar if is_categorical_x(xcol) else plot_line
+            jobs.append((plot_fn, d[[xcol, metric]], xcol, metric, title, xlabel, outpath))
+
+        if not is_categorical_x(xcol):
+            line_sweeps.setdefault(xcol, (xlabel, []))[1].append((exp, d))
+
+    # One overlay figure per metric for sweeps that share an x column
+    for xcol, (xlabel, sweeps) in line_sweeps.items():
+        if len(sweeps) < 2:
             continue
+        for metric in METRICS:
+            curves = [(exp, d[[xcol, metric]]) for exp, d in sweeps if metric in d.columns]
+            if len(curves) < 2:
+                continue
+            title = f"All sweeps: {metric} vs {xcol}"
+            outpath = out_dir / f"overlay_{safe_name(xcol)}_{metric}{suffix}"
+            jobs.append((plot_overlay, curves, xcol, metric, title, xlabel, outpath))
 
-        title = f"{exp}: {metric} vs {xcol}"
-        if context:
-            title += f" ({context})"
+    if not jobs:
+        print(f"No varying experiments in {args.csv}; nothing to plot.")
+        return
+    # Only create the output directory once there is something to write
+    out_dir.mkdir(parents=True, exist_ok=True)
 
-        outpath = OUT_DIR / f"{safe_name(exp)}_{metric}.png"
+    # Plots are independent, so render them across processes
+    # Each worker re-imports matplotlib, so never start more than there are plots
+    workers = min(args.jobs, len(jobs))
+    if workers > 1:
+        # spawn, not fork: pyarrow has already started threads in this process,
+        # and forking a multithreaded process can deadlock the children
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+            written = list(ex.map(render_one, jobs))
+    else:
+        written = [render_one(job) for job in jobs]
+    for outpath in written:
+        print(f"Wrote {outpath}")
 
-        if is_categorical_x(xcol):
-            plot_bar(d, xcol, metric, title, xlabel, outpath)
-        else:
-            plot_line(d, xcol, metric, title, xlabel, outpath)
+    if _FIG is not None:
+        _PLT.close(_FIG)
+    print("\nDone. Open images in:", out_dir)
 
-print("\nDone. Open images in:", OUT_DIR)
+if __name__ == "__main__":
+    main()